@@ -2,7 +2,9 @@
 
 import argparse
 import datetime
+import http.client
 import os
+import shlex
 import subprocess
 import time
 import sys
@@ -10,16 +12,49 @@ import sys
 testfile_filename = "why-random-50m"
 #testfile_filename = "ubuntu-22.04.1-desktop-amd64.iso"
 
-real_file_size = os.path.getsize(testfile_filename) / 1024 / 1024
+MIB = 1024 * 1024
+BITS_PER_BYTE = 8
+# Timings are integer nanoseconds from perf_counter_ns(), only converted to seconds for output.
+NS_PER_SEC = 1000 * 1000 * 1000
+
+total_data = os.path.getsize(testfile_filename)
 num_successes = 0
+gateway_host = "localhost"
+gateway_port = 1313
+# Reused for every upload so we don't pay for a curl process and a new TCP handshake each time.
+upload_connection = http.client.HTTPConnection(gateway_host, gateway_port)
+# One root shell, started through sudo at startup, runs every privileged command so we only pay for sudo once.
+privileged_shell = None
+
+def start_privileged_shell():
+    global privileged_shell
+    privileged_shell = subprocess.Popen(["sudo", "sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    # Wait for sudo to authenticate now, rather than in the middle of the first gateway restart.
+    run_privileged(["true"])
+
+
+def run_privileged(command):
+    # The command's own output goes to stderr, so the only thing on our pipe is its exit status.
+    try:
+        privileged_shell.stdin.write(f"{shlex.join(command)} </dev/null >&2; echo $?\n")
+        privileged_shell.stdin.flush()
+        status = privileged_shell.stdout.readline()
+    except BrokenPipeError:
+        status = ""
+    if not status:
+        print(f"Error: The privileged shell exited with status {privileged_shell.wait()}, check that sudo works for this user.")
+        exit(1)
+    return int(status)
+
 
 def stop_gateway():
     if not args.silent:
         print("Stopping WhyPFS Gateway")
-    subprocess.run(["sudo", "systemctl", "stop", "whypfs-gateway"])
-    time.sleep(1)
-    status = subprocess.run(["sudo", "systemctl", "is-active", "--quiet", "whypfs-gateway"])
-    if status.returncode == 0:
+    run_privileged(["systemctl", "stop", "whypfs-gateway"])
+    # The kept-alive upload connection won't survive the restart, it reconnects on the next upload.
+    upload_connection.close()
+    # systemctl stop only returns once the unit is inactive, so this check needs no settling delay.
+    if run_privileged(["systemctl", "is-active", "--quiet", "whypfs-gateway"]) == 0:
         print("Error: Failed to stop whypfs-gateway.")
         exit(1)
 
@@ -27,79 +62,102 @@ def stop_gateway():
 def start_gateway():
     if not args.silent:
         print("Starting WhyPFS Gateway")
-    subprocess.run(["sudo", "systemctl", "start", "whypfs-gateway"])
+    run_privileged(["systemctl", "start", "whypfs-gateway"])
 
 
 def remove_folder():
     if not args.silent:
         print("Removing folder /mnt/mfs/.whypfs")
-    subprocess.run(["sudo", "rm", "-r", "/mnt/mfs/.whypfs"])
+    run_privileged(["rm", "-r", "/mnt/mfs/.whypfs"])
 
 
 def wait_for_server():
     if not args.silent:
         print("Checking for IPFS Gateway liveness...")
+    # Probe over one connection, so once the gateway is listening each check skips the TCP handshake.
+    connection = http.client.HTTPConnection(gateway_host, gateway_port, timeout=0.5)
+    # Said once, the check itself repeats every 100 ms until the gateway answers.
+    if not args.silent:
+        print("Running check...")
     while True:
         try:
-            if not args.silent:
-                print("Running check...")
-            output = subprocess.check_output(
-                ["curl", "-s", "-f", "http://localhost:1313/gw/ipfs/QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"])
-            if output.decode("utf-8").strip() == "hello world":
+            if connection.sock is None:
+                connection.connect()
+                # The short timeout is only for connecting. With .whypfs freshly wiped the gateway may have to fetch
+                # the block from the network, so wait for its answer as long as it takes, like curl did.
+                connection.sock.settimeout(None)
+            connection.request("GET", "/gw/ipfs/QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o")
+            output = connection.getresponse().read()
+            if output.strip() == b"hello world":
                 if not args.silent:
                     print("\"Hello world\" found, which means IPFS is live. Continuing...")
                 break
-        except:
+        except (http.client.HTTPException, OSError):
             #print("Did not find the string we expected. Trying again...")
-            time.sleep(1)
-            pass
+            connection.close()
+        time.sleep(0.1)
+    connection.close()
+
+
+def multipart_form(testfile):
+    # Build the same multipart/form-data framing that `curl -F file=@testfile` would send around the file contents.
+    boundary = os.urandom(16).hex()
+    preamble = (f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(testfile)}\"\r\n"
+                "Content-Type: application/octet-stream\r\n\r\n").encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+    return boundary, preamble, epilogue
 
 
 def run_upload():
     global num_successes
-    start_time = time.monotonic()
-    result = subprocess.run(
-        ["curl", "-X", "POST", "-F", "file=@" + testfile_filename, "localhost:1313/upload"],
-        capture_output=True, text=True)
-    end_time = time.monotonic()
+    boundary, preamble, epilogue = multipart_form(testfile_filename)
+    content_length = len(preamble) + os.path.getsize(testfile_filename) + len(epilogue)
+    start_time = time.perf_counter_ns()
+    try:
+        upload_connection.putrequest("POST", "/upload")
+        upload_connection.putheader("Content-Type", f"multipart/form-data; boundary={boundary}")
+        upload_connection.putheader("Content-Length", str(content_length))
+        upload_connection.endheaders(message_body=preamble)
+        with open(testfile_filename, "rb") as f:
+            upload_connection.sock.sendfile(f)
+        upload_connection.send(epilogue)
+        output = upload_connection.getresponse().read().strip()
+    except (http.client.HTTPException, OSError) as e:
+        upload_connection.close()
+        print("Error: Failed to send upload request.")
+        print(e)
+        return
+    end_time = time.perf_counter_ns()
     transfer_time = end_time - start_time
-    if result.returncode == 0:
-        output = result.stdout.strip()
-        if output.startswith("baf"):
-            num_successes += 1
-            return transfer_time
-        else:
-            print("Error: Failed to upload file.")
+    if output.startswith(b"baf"):
+        num_successes += 1
+        return transfer_time
     else:
-        print("Error: Failed to run curl command.")
+        print("Error: Failed to upload file.")
 
 
 def print_report(run_number, transfer_time):
-    total_data = real_file_size * 1024 * 1024
-    transfer_rate = total_data / transfer_time
+    transfer_rate = total_data * NS_PER_SEC / transfer_time
     # We're converting from bytes/s to mbps here.
-    mbps = transfer_rate / 1024 / 1024 * 8 * 1.049
-    print(f"\n=== Run {run_number} ===")
-    print(f"Filename: " + testfile_filename)
-    print(f"Data transferred: {total_data / 1024 / 1024:.2f} MiB")
-    print(f"Transfer time: {transfer_time:.2f} seconds")
-    print(f"Transfer rate: {mbps:.2f} mbps")
-
-def save_report(run_number, transfer_time):
-    total_data = real_file_size * 1024 * 1024
-    transfer_rate = total_data / transfer_time
-    mbps = transfer_rate / 1024 / 1024 * 8 * 1.049
-    report_run_number = "{:03d}".format(run_number)
-    report_file_name = f"report-{datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')}-MooseFS-1c1t-{report_run_number}.txt"
-    report_file = open(report_file_name, 'w')
-
-    if report_file is not None:
-        report_file.write(f"\n=== Run {run_number} ===\n")
-        print(f"Filename: " + testfile_filename)
-        report_file.write(f"Data transferred: {total_data / 1024 / 1024:.2f} MiB\n")
-        report_file.write(f"Transfer time: {transfer_time:.2f} seconds\n")
-        report_file.write(f"Transfer rate: {mbps:.2f} mbps\n")
-        report_file.close()
+    mbps = transfer_rate / MIB * BITS_PER_BYTE * 1.049
+    # One write per report instead of one per line.
+    sys.stdout.write("\n".join([
+        f"\n=== Run {run_number} ===",
+        f"Filename: " + testfile_filename,
+        f"Data transferred: {total_data / MIB:.2f} MiB",
+        f"Transfer time: {transfer_time / NS_PER_SEC:.2f} seconds",
+        f"Transfer rate: {mbps:.2f} mbps",
+    ]) + "\n")
+
+def save_report(report_file, run_number, transfer_time):
+    transfer_rate = total_data * NS_PER_SEC / transfer_time
+    mbps = transfer_rate / MIB * BITS_PER_BYTE * 1.049
+    report_file.write(f"\n=== Run {run_number} ===\n")
+    report_file.write(f"Filename: " + testfile_filename + "\n")
+    report_file.write(f"Data transferred: {total_data / MIB:.2f} MiB\n")
+    report_file.write(f"Transfer time: {transfer_time / NS_PER_SEC:.2f} seconds\n")
+    report_file.write(f"Transfer rate: {mbps:.2f} mbps\n")
 
 def run_continuous(num_runs):
     best_time = None
@@ -108,6 +166,9 @@ def run_continuous(num_runs):
     slowest_speed = None
     total_time = 0
     total_speed = 0
+    # Every run's report goes into one buffered file, rather than opening and closing a file per run.
+    if args.report:
+        runs_report_file = open(f"report-{report_timestamp}-MooseFS-1c1t-all.txt", "w", buffering=MIB)
     for i in range(num_runs):
         print(f"\nRunning test {i + 1}...")
         stop_gateway()
@@ -117,36 +178,37 @@ def run_continuous(num_runs):
         transfer_time = run_upload()
         print_report(i+1, transfer_time)
         if args.report:
-            save_report(i+1, transfer_time)
-        total_data = real_file_size * 1024 * 1024
+            save_report(runs_report_file, i+1, transfer_time)
         total_time += transfer_time
-        total_speed += total_data / transfer_time
+        total_speed += total_data * NS_PER_SEC / transfer_time
         if best_time is None or transfer_time < best_time:
             best_time = transfer_time
-            best_speed = total_data / transfer_time
+            best_speed = total_data * NS_PER_SEC / transfer_time
         if slowest_time is None or transfer_time > slowest_time:
             slowest_time = transfer_time
-            slowest_speed = total_data / transfer_time
+            slowest_speed = total_data * NS_PER_SEC / transfer_time
+    if args.report:
+        runs_report_file.close()
     average_time = total_time / num_runs
     average_speed = total_speed / num_runs
 
-    overall_data_transferred = num_runs * real_file_size * 1024 * 1024
-    overall_data_transferred_MiB = overall_data_transferred / (1024 * 1024)
+    overall_data_transferred = num_runs * total_data
+    overall_data_transferred_MiB = overall_data_transferred / MIB
 
-    transfer_rate = overall_data_transferred / total_time
-    mbps = transfer_rate / 1024 / 1024 * 8
+    transfer_rate = overall_data_transferred * NS_PER_SEC / total_time
+    mbps = transfer_rate / MIB * BITS_PER_BYTE
 
     print(f"\n=== Final Report ===")
-    print(f"We moved {overall_data_transferred_MiB}MiB in {round(total_time, 3):.2f} seconds")
+    print(f"We moved {overall_data_transferred_MiB}MiB in {total_time / NS_PER_SEC:.2f} seconds")
     print(f"That's a transfer rate of {mbps:.2f} mbps.")
     print(f"\nWe performed {num_runs} total runs, {num_successes} of which succeeded.")
     print(f"That's a success rate of {num_successes/num_runs*100:.2f}%.")
-    print(f"\nBest time: {best_time:.2f} seconds")
-    print(f"Best speed: {best_speed / 1024 / 1024 * 8:.2f} mbps")
-    print(f"Slowest time: {slowest_time:.2f} seconds")
-    print(f"Slowest speed: {slowest_speed / 1024 / 1024 * 8:.2f} mbps")
-    print(f"Average time: {average_time:.2f} seconds")
-    print(f"Average speed: {average_speed / 1024 / 1024 * 8:.2f} mbps")
+    print(f"\nBest time: {best_time / NS_PER_SEC:.2f} seconds")
+    print(f"Best speed: {best_speed / MIB * BITS_PER_BYTE:.2f} mbps")
+    print(f"Slowest time: {slowest_time / NS_PER_SEC:.2f} seconds")
+    print(f"Slowest speed: {slowest_speed / MIB * BITS_PER_BYTE:.2f} mbps")
+    print(f"Average time: {average_time / NS_PER_SEC:.2f} seconds")
+    print(f"Average speed: {average_speed / MIB * BITS_PER_BYTE:.2f} mbps")
 
 
 if __name__ == "__main__":
@@ -156,6 +218,9 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--silent", help="run silently - only produce reports", action=argparse.BooleanOptionalAction)
     args = parser.parse_args()
 
+    report_timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+    start_privileged_shell()
+
     if args.report is not None:
         report_file = open(args.report, "w")
         sys.stdout = report_file
@@ -168,7 +233,8 @@ if __name__ == "__main__":
         transfer_time = run_upload()
         print_report(1, transfer_time)
         if args.report:
-            save_report(1, transfer_time)
+            with open(f"report-{report_timestamp}-MooseFS-1c1t-all.txt", "w") as runs_report_file:
+                save_report(runs_report_file, 1, transfer_time)
     else:
         run_continuous(args.continuous)
 
@@ -2,88 +2,459 @@
 # Let's run everything in parallel this time
 
 import argparse
+import asyncio
+import ctypes
 import datetime
+import errno
+import http.client
+import mmap
 import os
+import platform
+import queue
+import shlex
+import socket
+import struct
 import subprocess
 import time
 import sys
 import concurrent.futures
-from threading import Thread
 
-num_successes = 0
+try:
+    import liburing
+except ImportError:
+    # Only --uring needs it.
+    liburing = None
+
+MIB = 1024 * 1024
+BITS_PER_BYTE = 8
+# Timings are integer nanoseconds from perf_counter_ns(), only converted to seconds for output.
+NS_PER_SEC = 1000 * 1000 * 1000
 
-def generate_testfile(thread_num):
+num_successes = 0
+gateway_host = "localhost"
+gateway_port = 1313
+# Kept-alive connections to the gateway, shared between upload threads and reused across runs.
+upload_connections = queue.SimpleQueue()
+# Read-only mappings of every testfile, held open so their pages stay resident in the page cache.
+testfile_mmaps = []
+# One root shell, started through sudo on first use, runs every privileged command so we only pay for sudo once.
+privileged_shell = None
+# inotify isn't wrapped by the standard library, so call it straight from libc where there is one.
+libc = ctypes.CDLL(None, use_errno=True) if platform.system() == "Linux" else None
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+# The --uring ring and the request buffers it sends from, set up once per session by setup_uring().
+uring_ring = None
+uring_requests = []
+uring_recv_buffers = []
+# Each request's testfile contents, as views into uring_requests.
+uring_payloads = []
+# Whether uring_requests are registered with the ring, otherwise they're sent with plain sends.
+uring_fixed_buffers = False
+# The sockets of the next --uring run, connected and registered by connect_uring() before the clock starts.
+uring_sockets = []
+# Objects handed to the kernel at registration, held onto until they're unregistered.
+uring_registrations = []
+
+def prepare_testfiles():
     if not args.silent:
-        print(f"Generating testfile for thread {thread_num}")
-    subprocess.run(["dd", "if=/dev/urandom", f"of=testfile-{thread_num:03}.bin", f"bs={args.blobsize}M", "count=1"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        print(f"Creating testfiles for {args.threads} thread(s)")
+    # Only size the testfiles here, run_upload fills them with fresh random data before every run, the first included.
+    # Mapping them now faults their pages into memory, and the rewrites land in those same resident pages.
+    for thread_num in range(args.threads):
+        fd = os.open(f"testfile-{thread_num:03}.bin", os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(fd, args.blobsize * MIB)
+        mm = mmap.mmap(fd, 0, flags=mmap.MAP_SHARED | mmap.MAP_POPULATE, prot=mmap.PROT_READ)
+        os.close(fd)
+        mm.madvise(mmap.MADV_WILLNEED)
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+        testfile_mmaps.append(mm)
+
+
+def write_random_testfile(testfile):
+    # Random from end to end, so no block the gateway chunks this upload into repeats in any other upload.
+    fd = os.open(testfile, os.O_WRONLY | os.O_CREAT, 0o644)
+    os.ftruncate(fd, args.blobsize * MIB)
+    for offset in range(0, args.blobsize * MIB, MIB):
+        os.pwrite(fd, os.urandom(MIB), offset)
+    # Flush it to disk now, so writeback doesn't compete with the uploads later.
+    os.fsync(fd)
+    os.close(fd)
+
+
+def multipart_form(testfile):
+    # Build the same multipart/form-data framing that `curl -F file=@testfile` would send around the file contents.
+    boundary = os.urandom(16).hex()
+    preamble = (f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(testfile)}\"\r\n"
+                "Content-Type: application/octet-stream\r\n\r\n").encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+    return boundary, preamble, epilogue
+
+
+def post_testfile(testfile):
+    boundary, preamble, epilogue = multipart_form(testfile)
+    content_length = len(preamble) + os.path.getsize(testfile) + len(epilogue)
+    # Reuse a kept-alive connection if one is spare, so we skip the TCP handshake on every upload.
+    try:
+        connection = upload_connections.get_nowait()
+    except queue.Empty:
+        connection = None
+    while True:
+        reused = connection is not None
+        if connection is None:
+            connection = http.client.HTTPConnection(gateway_host, gateway_port)
+        try:
+            connection.putrequest("POST", "/upload")
+            connection.putheader("Content-Type", f"multipart/form-data; boundary={boundary}")
+            connection.putheader("Content-Length", str(content_length))
+            connection.endheaders(message_body=preamble)
+            # Let the kernel move the file from the page cache straight onto the socket, no copy through Python.
+            with open(testfile, "rb") as f:
+                connection.sock.sendfile(f)
+            connection.send(epilogue)
+            response = connection.getresponse()
+            output = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if reused:
+                # The gateway may have been restarted since this connection was last used, so retry on a fresh one.
+                connection = None
+                continue
+            raise
+        upload_connections.put(connection)
+        return output
+
+
+def wait_for_trigger(run_number):
+    if libc is None:
+        # No inotify off Linux, so poll for the trigger instead.
+        while not os.path.exists(f"/tmp/trigger-{run_number}"):
+            time.sleep(0.04)
+        return
+    trigger_name = f"trigger-{run_number}".encode()
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    try:
+        # Watch /tmp before checking for the trigger, so it can't appear unnoticed in between.
+        if libc.inotify_add_watch(fd, b"/tmp", IN_CREATE | IN_MOVED_TO) < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        if os.path.exists(b"/tmp/" + trigger_name):
+            return
+        while True:
+            events = os.read(fd, 4096)
+            offset = 0
+            while offset < len(events):
+                # struct inotify_event is wd, mask, cookie and len, followed by a NUL-padded name of len bytes.
+                name_length = struct.unpack_from("iIII", events, offset)[3]
+                offset += 16
+                if events[offset:offset + name_length].rstrip(b"\0") == trigger_name:
+                    return
+                offset += name_length
+    finally:
+        os.close(fd)
+
+
+def open_upload_connections():
+    # Have a connected keep-alive connection ready for every upload thread, so no handshake lands in the timed section.
+    for _ in range(args.threads):
+        connection = http.client.HTTPConnection(gateway_host, gateway_port)
+        try:
+            connection.connect()
+        except OSError:
+            # Leave it to the upload itself to connect and report the failure.
+            connection.close()
+            continue
+        upload_connections.put(connection)
+
+
+def close_upload_connections():
+    while not upload_connections.empty():
+        upload_connections.get_nowait().close()
 
 
 def upload_thread(thread_num, testfile):
-    global num_successes
-    start_time = time.monotonic()
-    result = subprocess.run(
-        ["curl", "-X", "POST", "-F", "file=@" + testfile, "localhost:1313/upload"],
-        capture_output=True, text=True)
-    end_time = time.monotonic()
+    start_time = time.perf_counter_ns()
+    try:
+        output = post_testfile(testfile).strip()
+    except (http.client.HTTPException, OSError) as e:
+        print(f"Error: Failed to send upload request for thread {thread_num}.")
+        print(e)
+        return None
+    end_time = time.perf_counter_ns()
     transfer_time = end_time - start_time
-    if result.returncode == 0:
-        output = result.stdout.strip()
-        if output.startswith("baf"):
-            # We successfully uploaded a file using this thread, record a victory!
-            num_successes += 1
-            # If we're not in silent mode, output a helpful message.
-            if not args.silent:
-                print(f"Thread {thread_num}: Upload succeeded, took {transfer_time:.2f} seconds end-to-end")
-            return transfer_time
-        else:
-            print(f"Error: Failed to upload file for thread {thread_num}.")
-            print(output)
+    if output.startswith(b"baf"):
+        # We successfully uploaded a file using this thread, record a victory!
+        # If we're not in silent mode, output a helpful message.
+        if not args.silent:
+            print(f"Thread {thread_num}: Upload succeeded, took {transfer_time / NS_PER_SEC:.2f} seconds end-to-end")
+        return transfer_time
     else:
-        print(f"Error: Failed to run curl command for thread {thread_num}.")
-        print(result)
+        print(f"Error: Failed to upload file for thread {thread_num}.")
+        print(output.decode("utf-8", errors="replace"))
     return None
 
 
-def run_upload(run_number):
+async def upload_coroutine(thread_num, testfile, stream):
+    if isinstance(stream, Exception):
+        print(f"Error: Failed to connect to the gateway for thread {thread_num}.")
+        print(stream)
+        return None
+    reader, writer = stream
+    boundary, preamble, epilogue = multipart_form(testfile)
+    content_length = len(preamble) + os.path.getsize(testfile) + len(epilogue)
+    request_headers = (f"POST /upload HTTP/1.1\r\n"
+                       f"Host: {gateway_host}:{gateway_port}\r\n"
+                       f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
+                       f"Content-Length: {content_length}\r\n"
+                       "Connection: close\r\n\r\n").encode()
+    start_time = time.perf_counter_ns()
+    try:
+        writer.write(request_headers + preamble)
+        with open(testfile, "rb") as f:
+            await asyncio.get_running_loop().sendfile(writer.transport, f)
+        writer.write(epilogue)
+        await writer.drain()
+        # The gateway closes the connection once it has answered, so everything up to EOF is the response.
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+    except OSError as e:
+        writer.close()
+        print(f"Error: Failed to send upload request for thread {thread_num}.")
+        print(e)
+        return None
+    end_time = time.perf_counter_ns()
+    transfer_time = end_time - start_time
+    output = response.partition(b"\r\n\r\n")[2].strip()
+    if output.startswith(b"baf"):
+        if not args.silent:
+            print(f"Thread {thread_num}: Upload succeeded, took {transfer_time / NS_PER_SEC:.2f} seconds end-to-end")
+        return transfer_time
+    else:
+        print(f"Error: Failed to upload file for thread {thread_num}.")
+        print(output.decode("utf-8", errors="replace"))
+    return None
+
+
+async def open_upload_streams():
+    # Connect every upload's stream up front, so like the other backends the clock only covers the uploads themselves.
+    return await asyncio.gather(*(asyncio.open_connection(gateway_host, gateway_port) for _ in range(args.threads)),
+                                return_exceptions=True)
+
+
+async def upload_all(streams):
+    # Every upload is in flight at once on this one event loop, no thread or process per upload.
+    return await asyncio.gather(*(upload_coroutine(i, f"testfile-{i:03}.bin", streams[i]) for i in range(args.threads)))
+
+
+def setup_uring():
+    global uring_ring, uring_fixed_buffers
+    uring_ring = liburing.Ring()
+    # With SQPOLL a kernel thread picks up new SQEs itself, so io_uring_submit() only bumps the SQ tail
+    # and skips the io_uring_enter syscall unless that thread has gone idle.
+    liburing.io_uring_queue_init(max(256, args.threads * 2), uring_ring, liburing.IORING_SETUP_SQPOLL)
+    for i in range(args.threads):
+        testfile = f"testfile-{i:03}.bin"
+        boundary, preamble, epilogue = multipart_form(testfile)
+        payload = testfile_mmaps[i]
+        request_headers = (f"POST /upload HTTP/1.1\r\n"
+                           f"Host: {gateway_host}:{gateway_port}\r\n"
+                           f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
+                           f"Content-Length: {len(preamble) + len(payload) + len(epilogue)}\r\n"
+                           "Connection: close\r\n\r\n").encode()
+        # The kernel won't register file-backed pages as fixed buffers, so assemble each request in
+        # anonymous memory, copied from the testfile's already-resident mapping.
+        request = bytearray(request_headers)
+        request += preamble
+        request += payload
+        request += epilogue
+        uring_requests.append(request)
+        payload_start = len(request_headers) + len(preamble)
+        uring_payloads.append(memoryview(request)[payload_start:payload_start + len(payload)])
+        uring_recv_buffers.append(bytearray(4096))
+    # Registered buffers are pinned once for the whole session, instead of the kernel pinning the pages on every send.
+    request_iovecs = liburing.Iovec(uring_requests)
+    try:
+        liburing.io_uring_register_buffers(uring_ring, request_iovecs)
+    except OSError as e:
+        if e.errno != errno.ENOMEM:
+            raise
+        # Pinned pages count against RLIMIT_MEMLOCK unless we have CAP_IPC_LOCK.
+        print(f"Warning: Can't pin {len(uring_requests)} x {args.blobsize} MiB of upload buffers within the locked memory limit (ulimit -l), "
+              "sending them with plain sends instead of zero-copy fixed-buffer sends.")
+        return
+    uring_registrations.append(request_iovecs)
+    uring_fixed_buffers = True
+
+
+def refresh_uring_payloads():
+    # The testfiles were just rewritten, so copy their new contents into the buffers the ring sends from.
+    for payload, mm in zip(uring_payloads, testfile_mmaps):
+        payload[:] = mm
+
+
+def connect_uring():
+    for i in range(args.threads):
+        try:
+            uring_sockets.append(socket.create_connection((gateway_host, gateway_port)))
+        except OSError as e:
+            print(f"Error: Failed to connect to the gateway for thread {i}.")
+            print(e)
+            for s in uring_sockets:
+                s.close()
+            uring_sockets.clear()
+            return False
+    # Registered files let the kernel skip the fd lookup and refcounting on every operation.
+    file_index = liburing.FileIndex([s.fileno() for s in uring_sockets])
+    liburing.io_uring_register_files(uring_ring, file_index)
+    uring_registrations.append(file_index)
+    for i in range(args.threads):
+        # Each upload is a send linked to the first recv of its response, user_data 2i and 2i+1.
+        sqe = liburing.io_uring_get_sqe(uring_ring)
+        if uring_fixed_buffers:
+            liburing.io_uring_prep_send_zc_fixed(sqe, i, uring_requests[i], i, socket.MSG_WAITALL)
+        else:
+            liburing.io_uring_prep_send(sqe, i, uring_requests[i], socket.MSG_WAITALL)
+        liburing.io_uring_sqe_set_flags(sqe, liburing.IOSQE_FIXED_FILE | liburing.IOSQE_IO_LINK)
+        liburing.io_uring_sqe_set_data64(sqe, 2 * i)
+        sqe = liburing.io_uring_get_sqe(uring_ring)
+        liburing.io_uring_prep_recv(sqe, i, uring_recv_buffers[i])
+        liburing.io_uring_sqe_set_flags(sqe, liburing.IOSQE_FIXED_FILE)
+        liburing.io_uring_sqe_set_data64(sqe, 2 * i + 1)
+    return True
+
+
+def disconnect_uring():
+    liburing.io_uring_unregister_files(uring_ring)
+    uring_registrations.pop()
+    for s in uring_sockets:
+        s.close()
+    uring_sockets.clear()
+
+
+def upload_uring():
+    try:
+        # connect_uring() already prepared this run's SQEs, so one syscall puts every upload in flight.
+        start_time = time.perf_counter_ns()
+        liburing.io_uring_submit(uring_ring)
+        transfer_times = [None] * args.threads
+        responses = [bytearray() for _ in range(args.threads)]
+        pending = args.threads
+        cqe = liburing.Cqe()
+        while pending:
+            liburing.io_uring_wait_cqe(uring_ring, cqe)
+            entry = cqe[0]
+            user_data, res, flags = entry.user_data, entry.res, entry.flags
+            liburing.io_uring_cqe_seen(uring_ring, entry)
+            if flags & liburing.IORING_CQE_F_NOTIF:
+                # A zero-copy send posts this extra completion once the kernel is done with the buffer.
+                continue
+            thread_num, is_recv = divmod(user_data, 2)
+            if not is_recv:
+                if res < 0:
+                    print(f"Error: Failed to send upload request for thread {thread_num}.")
+                    print(os.strerror(-res))
+                continue
+            if res > 0:
+                # We sent "Connection: close", so keep reading until the gateway hangs up.
+                responses[thread_num] += uring_recv_buffers[thread_num][:res]
+                sqe = liburing.io_uring_get_sqe(uring_ring)
+                liburing.io_uring_prep_recv(sqe, thread_num, uring_recv_buffers[thread_num])
+                liburing.io_uring_sqe_set_flags(sqe, liburing.IOSQE_FIXED_FILE)
+                liburing.io_uring_sqe_set_data64(sqe, user_data)
+                liburing.io_uring_submit(uring_ring)
+                continue
+            pending -= 1
+            if res < 0:
+                # A failed send cancels its linked recv, and that failure was already reported above.
+                if res != -errno.ECANCELED:
+                    print(f"Error: Failed to read upload response for thread {thread_num}.")
+                    print(os.strerror(-res))
+                continue
+            transfer_time = time.perf_counter_ns() - start_time
+            output = responses[thread_num].partition(b"\r\n\r\n")[2].strip()
+            if output.startswith(b"baf"):
+                if not args.silent:
+                    print(f"Thread {thread_num}: Upload succeeded, took {transfer_time / NS_PER_SEC:.2f} seconds end-to-end")
+                transfer_times[thread_num] = transfer_time
+            else:
+                print(f"Error: Failed to upload file for thread {thread_num}.")
+                print(output.decode("utf-8", errors="replace"))
+        return transfer_times
+    finally:
+        disconnect_uring()
+
+
+def run_upload(run_number, executor):
     global num_successes
-    num_successes = 0
-    threads = []
-    slowest_time = float("-inf")
-    fastest_time = float("inf")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-        # Generate test files in parallel
-        executor.map(generate_testfile, range(args.threads))
-        # Wait for final disk activity to settle
-        time.sleep(1)
-        # Wait for a file to appear telling this group of threads to run
-        while not os.path.exists("/tmp/trigger-" + str(run_number)):
-            #print("looking for /mnt/mfs/trigger-" + str(run_number))
-            time.sleep(0.04)
-        # Record the start time
-        start_time = time.monotonic()
-        # Upload files and record transfer times
+    # The gateway keeps its blockstore between runs here, so rewrite every testfile with fresh random data.
+    # Anything less would leave most of this run's blocks already stored by the last one.
+    list(executor.map(write_random_testfile, (f"testfile-{i:03}.bin" for i in range(args.threads))))
+    if args.uring:
+        refresh_uring_payloads()
+    # The gateway may have dropped last run's idle connections while we waited, so don't find that out mid-upload.
+    close_upload_connections()
+    # Wait for a file to appear telling this group of threads to run
+    wait_for_trigger(run_number)
+    if args.uring:
+        # Connect and register the sockets before the clock starts, so only the uploads themselves are timed.
+        uring_ready = connect_uring()
+    elif args.asyncio:
+        # Streams belong to the loop that opened them, so connect on the same loop that will run the uploads.
+        upload_loop = asyncio.new_event_loop()
+        upload_streams = upload_loop.run_until_complete(open_upload_streams())
+    else:
+        open_upload_connections()
+    # Record the start time
+    start_time = time.perf_counter_ns()
+    # Upload files and record transfer times
+    if args.uring:
+        transfer_times = upload_uring() if uring_ready else [None] * args.threads
+    elif args.asyncio:
+        transfer_times = upload_loop.run_until_complete(upload_all(upload_streams))
+        upload_loop.close()
+    else:
         futures = [executor.submit(upload_thread, i, f"testfile-{i:03}.bin") for i in range(args.threads)]
-        for future in concurrent.futures.as_completed(futures):
-            transfer_time = future.result()
-            if transfer_time is not None:
-                if transfer_time > slowest_time:
-                    slowest_time = transfer_time
-                if transfer_time < fastest_time:
-                    fastest_time = transfer_time
-
-    end_time = time.monotonic()
+        transfer_times = (future.result() for future in concurrent.futures.as_completed(futures))
+    successful_times = [transfer_time for transfer_time in transfer_times if transfer_time is not None]
+    # Count the victories here from the results, rather than having every upload bump a shared global.
+    num_successes = len(successful_times)
+    slowest_time = max(successful_times, default=float("-inf"))
+    fastest_time = min(successful_times, default=float("inf"))
+
+    end_time = time.perf_counter_ns()
     transfer_time = end_time - start_time
     return transfer_time, slowest_time, fastest_time, num_successes
 
 
+def run_privileged(command):
+    global privileged_shell
+    if privileged_shell is None:
+        # Runs here never restart the gateway, so only ask for sudo once something actually needs it.
+        privileged_shell = subprocess.Popen(["sudo", "sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    # The command's own output goes to stderr, so the only thing on our pipe is its exit status.
+    try:
+        privileged_shell.stdin.write(f"{shlex.join(command)} </dev/null >&2; echo $?\n")
+        privileged_shell.stdin.flush()
+        status = privileged_shell.stdout.readline()
+    except BrokenPipeError:
+        status = ""
+    if not status:
+        print(f"Error: The privileged shell exited with status {privileged_shell.wait()}, check that sudo works for this user.")
+        exit(1)
+    return int(status)
+
+
 def stop_gateway():
     if not args.silent:
         print("Stopping WhyPFS Gateway")
-    subprocess.run(["sudo", "systemctl", "stop", "whypfs-gateway"])
-    subprocess.run(["sudo", "systemctl", "stop", "whypfs-gateway-seaweed"])
-    time.sleep(1)
-    status = subprocess.run(["sudo", "systemctl", "is-active", "--quiet", "whypfs-gateway"])
-    if status.returncode == 0:
+    run_privileged(["systemctl", "stop", "whypfs-gateway", "whypfs-gateway-seaweed"])
+    # Kept-alive upload connections won't survive the restart, so don't hand them out again.
+    close_upload_connections()
+    # systemctl stop only returns once the unit is inactive, so this check needs no settling delay.
+    if run_privileged(["systemctl", "is-active", "--quiet", "whypfs-gateway"]) == 0:
         print("Error: Failed to stop whypfs-gateway.")
         exit(1)
 
@@ -92,101 +463,99 @@ def start_gateway():
     if not args.silent:
         print("Starting WhyPFS Gateway")
     if args.label == "MooseFS":
-        subprocess.run(["sudo", "systemctl", "start", "whypfs-gateway"])
+        run_privileged(["systemctl", "start", "whypfs-gateway"])
     else:
-        subprocess.run(["sudo", "systemctl", "start", "whypfs-gateway-seaweed"])
+        run_privileged(["systemctl", "start", "whypfs-gateway-seaweed"])
 
 
 def remove_folder():
     if not args.silent:
         print("Removing folder .whypfs")
     if args.label == "MooseFS":
-        subprocess.run(["sudo", "rm", "-r", "/mnt/mfs/.whypfs"])
+        run_privileged(["rm", "-r", "/mnt/mfs/.whypfs"])
     else:
-        subprocess.run(["sudo", "rm", "-r", "/mnt/seaweedfs/.whypfs"])
+        run_privileged(["rm", "-r", "/mnt/seaweedfs/.whypfs"])
     
 
 
 def wait_for_server():
     if not args.silent:
         print("Checking for IPFS Gateway liveness...")
+    # Probe over one connection, so once the gateway is listening each check skips the TCP handshake.
+    connection = http.client.HTTPConnection(gateway_host, gateway_port, timeout=0.5)
+    # Said once, the check itself repeats every 100 ms until the gateway answers.
+    if not args.silent:
+        print("Running check...")
     while True:
         try:
-            if not args.silent:
-                print("Running check...")
-            output = subprocess.check_output(
-                ["curl", "-s", "-f", "http://localhost:1313/gw/ipfs/QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"])
-            if output.decode("utf-8").strip() == "hello world":
+            if connection.sock is None:
+                connection.connect()
+                # The short timeout is only for connecting. With .whypfs freshly wiped the gateway may have to fetch
+                # the block from the network, so wait for its answer as long as it takes, like curl did.
+                connection.sock.settimeout(None)
+            connection.request("GET", "/gw/ipfs/QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o")
+            output = connection.getresponse().read()
+            if output.strip() == b"hello world":
                 if not args.silent:
                     print("\"Hello world\" found, which means IPFS is live. Continuing...")
                 break
-        except:
+        except (http.client.HTTPException, OSError):
             #print("Did not find the string we expected. Trying again...")
-            time.sleep(1)
-            pass
+            connection.close()
+        time.sleep(0.1)
+    connection.close()
 
 
 def print_report(run_number, transfer_time, slowest_time, fastest_time):
-    if args.threads == 1:
-        total_data = args.blobsize * 1024 * 1024
-    else:
-        total_data = args.threads * args.blobsize * 1024 * 1024
     if args.threads > 1:
         total_data_success = total_data * (num_successes / args.threads)
-    transfer_rate = total_data / transfer_time
+    transfer_rate = total_data * NS_PER_SEC / transfer_time
     # We're converting from bytes/s to mbps here.
-    mbps = transfer_rate / 1024 / 1024 * 8
+    mbps = transfer_rate / MIB * BITS_PER_BYTE
     # Now let's apply a modifier which is the bandwidth discounting failed threads, but only when we have more than 1 thread
     if args.threads > 1:
         mbps = mbps * (num_successes / args.threads)
-    print(f"\n=== Run {run_number} ===")
+    lines = [f"\n=== Run {run_number} ==="]
     if args.threads == 1:
-        print(f"Filename: testfile-000.bin")
+        lines.append(f"Filename: testfile-000.bin")
     else:
-        print("Filename: testfile-[threadid].bin")
-        print(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.")
-        print(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.")
-    print(f"Data transferred: {total_data / 1024 / 1024:.2f} MiB")
+        lines.append("Filename: testfile-[threadid].bin")
+        lines.append(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.")
+        lines.append(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.")
+    lines.append(f"Data transferred: {total_data / MIB:.2f} MiB")
     if args.threads > 1:
-        print(f"Data successfully transferred: {total_data_success / 1024 / 1024:.2f} MiB")
-        print(f"Slowest thread: {slowest_time:.2f} seconds")
-        print(f"Fastest thread: {fastest_time:.2f} seconds")
-    print(f"Transfer time: {transfer_time:.2f} seconds")
-    print(f"Transfer rate: {mbps:.2f} mbps")
+        lines.append(f"Data successfully transferred: {total_data_success / MIB:.2f} MiB")
+        lines.append(f"Slowest thread: {slowest_time / NS_PER_SEC:.2f} seconds")
+        lines.append(f"Fastest thread: {fastest_time / NS_PER_SEC:.2f} seconds")
+    lines.append(f"Transfer time: {transfer_time / NS_PER_SEC:.2f} seconds")
+    lines.append(f"Transfer rate: {mbps:.2f} mbps")
+    # One write per report instead of one per line.
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
-def save_report(run_number, transfer_time, slowest_time, fastest_time):
-    if args.threads == 1:
-        total_data = args.blobsize * 1024 * 1024
-    else:
-        total_data = args.threads * args.blobsize * 1024 * 1024
+def save_report(report_file, run_number, transfer_time, slowest_time, fastest_time):
     if args.threads > 1:
         total_data_success = total_data * (num_successes / args.threads)
-    transfer_rate = total_data / transfer_time
+    transfer_rate = total_data * NS_PER_SEC / transfer_time
     # We're converting from bytes/s to mbps here.
-    mbps = transfer_rate / 1024 / 1024 * 8
-    report_run_number = "{:03d}".format(run_number)
-    report_file_name = f"report-{report_timestamp}-{args.label}-{report_run_number}.txt"
-    report_file = open(report_file_name, 'w')
-
-    if report_file is not None:
-        report_file.write(f"\n=== Run {run_number} ===\n")
-        
-        if args.threads == 1:
-            report_file.write(f"Filename: testfile-000.bin")
-        else:
-            report_file.write("Filename: testfile-[threadid].bin")
-            report_file.write(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.")
-            report_file.write(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.")
-
-        report_file.write(f"Data transferred: {total_data / 1024 / 1024:.2f} MiB\n")
-        if args.threads > 1:
-            report_file.write(f"Data successfully transferred: {total_data_success / 1024 / 1024:.2f} MiB")
-            report_file.write(f"Slowest thread: {slowest_time:.2f} seconds")
-            report_file.write(f"Fastest thread: {fastest_time:.2f} seconds")
-        report_file.write(f"Transfer time: {transfer_time:.2f} seconds\n")
-        report_file.write(f"Transfer rate: {mbps:.2f} mbps\n")
-        report_file.close()
+    mbps = transfer_rate / MIB * BITS_PER_BYTE
+
+    report_file.write(f"\n=== Run {run_number} ===\n")
+
+    if args.threads == 1:
+        report_file.write(f"Filename: testfile-000.bin\n")
+    else:
+        report_file.write("Filename: testfile-[threadid].bin\n")
+        report_file.write(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.\n")
+        report_file.write(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.\n")
+
+    report_file.write(f"Data transferred: {total_data / MIB:.2f} MiB\n")
+    if args.threads > 1:
+        report_file.write(f"Data successfully transferred: {total_data_success / MIB:.2f} MiB\n")
+        report_file.write(f"Slowest thread: {slowest_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Fastest thread: {fastest_time / NS_PER_SEC:.2f} seconds\n")
+    report_file.write(f"Transfer time: {transfer_time / NS_PER_SEC:.2f} seconds\n")
+    report_file.write(f"Transfer rate: {mbps:.2f} mbps\n")
 
 
 def run_continuous(num_runs):
@@ -198,52 +567,64 @@ def run_continuous(num_runs):
     slowest_speed = None
     total_time = 0
     total_speed = 0
-    for i in range(num_runs):
-        print(f"\nRunning test {i + 1}...")
-        wait_for_server()
-        transfer_time = run_upload(i+1)
-        # Grab the num_successes reported by our run of upload threads, and add it to the total number of successes.
-        num_successes_total += transfer_time[3]
-        print_report(i+1, transfer_time[0], transfer_time[1], transfer_time[2])
-        if args.report:
-            save_report(i+1, transfer_time[0], transfer_time[1], transfer_time[2])
-        total_data = args.threads * args.blobsize * 1024 * 1024
-        total_time += transfer_time[0]
-        total_speed += total_data / transfer_time[0]
-        if best_time is None:
-            best_time = transfer_time[0]
-            best_speed = total_data / transfer_time[0]
-        if transfer_time[0] < best_time:
-            best_time = transfer_time[0]
-            best_speed = total_data / transfer_time[0]
-        if slowest_time is None:
-            slowest_time = transfer_time[0]
-            slowest_speed = total_data / transfer_time[0]
-        if transfer_time[0] > slowest_time:
-            slowest_time = transfer_time[0]
-            slowest_speed = total_data / transfer_time[0]
+    # Create and map the testfiles once, each run fills them with new contents.
+    prepare_testfiles()
+    if args.uring:
+        setup_uring()
+    # Every run's report goes into one buffered file, rather than opening and closing a file per run.
+    if args.report:
+        runs_report_file = open(f"report-{report_timestamp}-{args.label}-all.txt", "w", buffering=MIB)
+    # Share one pool of threads across every run instead of starting a fresh one each time, it rewrites the testfiles too.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for i in range(num_runs):
+            print(f"\nRunning test {i + 1}...")
+            wait_for_server()
+            transfer_time = run_upload(i+1, executor)
+            # Grab the num_successes reported by our run of upload threads, and add it to the total number of successes.
+            num_successes_total += transfer_time[3]
+            print_report(i+1, transfer_time[0], transfer_time[1], transfer_time[2])
+            if args.report:
+                save_report(runs_report_file, i+1, transfer_time[0], transfer_time[1], transfer_time[2])
+            total_time += transfer_time[0]
+            total_speed += total_data * NS_PER_SEC / transfer_time[0]
+            if best_time is None:
+                best_time = transfer_time[0]
+                best_speed = total_data * NS_PER_SEC / transfer_time[0]
+            if transfer_time[0] < best_time:
+                best_time = transfer_time[0]
+                best_speed = total_data * NS_PER_SEC / transfer_time[0]
+            if slowest_time is None:
+                slowest_time = transfer_time[0]
+                slowest_speed = total_data * NS_PER_SEC / transfer_time[0]
+            if transfer_time[0] > slowest_time:
+                slowest_time = transfer_time[0]
+                slowest_speed = total_data * NS_PER_SEC / transfer_time[0]
+    if args.uring:
+        liburing.io_uring_queue_exit(uring_ring)
+    if args.report:
+        runs_report_file.close()
     average_time = total_time / num_runs
     average_speed = total_speed / num_runs
 
     # We calculate how much data transfer occurred by considering how much failed as well.
-    overall_data_transferred = (num_successes_total / (num_runs * args.threads)) * (num_runs * args.threads) * args.blobsize * 1024 * 1024
-    overall_data_transferred_MiB = overall_data_transferred / (1024 * 1024)
+    overall_data_transferred = (num_successes_total / (num_runs * args.threads)) * (num_runs * args.threads) * args.blobsize * MIB
+    overall_data_transferred_MiB = overall_data_transferred / MIB
 
-    transfer_rate = overall_data_transferred / total_time
-    mbps = transfer_rate / 1024 / 1024 * 8
+    transfer_rate = overall_data_transferred * NS_PER_SEC / total_time
+    mbps = transfer_rate / MIB * BITS_PER_BYTE
 
     # Print final report
     print(f"\n=== Final Report ===")
-    print(f"We moved {overall_data_transferred_MiB}MiB in {round(total_time, 3):.2f} seconds")
+    print(f"We moved {overall_data_transferred_MiB}MiB in {total_time / NS_PER_SEC:.2f} seconds")
     print(f"That's a transfer rate of {mbps:.2f} mbps.")
     print(f"\nWe performed {num_runs * args.threads} transfers across {num_runs} total run(s), {num_successes_total} of which succeeded.")
     print(f"That's a success rate of { (num_successes_total / (num_runs * args.threads)) *100:.2f}%.")
-    print(f"\nBest run time: {best_time:.2f} seconds")
-    print(f"Best run speed: {best_speed / 1024 / 1024 * 8:.2f} mbps")
-    print(f"Slowest run time: {slowest_time:.2f} seconds")
-    print(f"Slowest run speed: {slowest_speed / 1024 / 1024 * 8:.2f} mbps")
-    print(f"Average run time: {average_time:.2f} seconds")
-    print(f"Average run speed: {average_speed / 1024 / 1024 * 8:.2f} mbps")
+    print(f"\nBest run time: {best_time / NS_PER_SEC:.2f} seconds")
+    print(f"Best run speed: {best_speed / MIB * BITS_PER_BYTE:.2f} mbps")
+    print(f"Slowest run time: {slowest_time / NS_PER_SEC:.2f} seconds")
+    print(f"Slowest run speed: {slowest_speed / MIB * BITS_PER_BYTE:.2f} mbps")
+    print(f"Average run time: {average_time / NS_PER_SEC:.2f} seconds")
+    print(f"Average run speed: {average_speed / MIB * BITS_PER_BYTE:.2f} mbps")
 
     # Save final report
     if args.report:
@@ -251,16 +632,16 @@ def run_continuous(num_runs):
         report_file_name = f"report-{report_timestamp}-{args.label}-final.txt"
         report_file = open(report_file_name, 'w')
         report_file.write(f"\n=== Final Report ===\n")
-        report_file.write(f"We moved {overall_data_transferred_MiB}MiB in {round(total_time, 3):.2f} seconds\n")
+        report_file.write(f"We moved {overall_data_transferred_MiB}MiB in {total_time / NS_PER_SEC:.2f} seconds\n")
         report_file.write(f"That's a transfer rate of {mbps:.2f} mbps.\n")
         report_file.write(f"\nWe performed {num_runs * args.threads} transfers across {num_runs} total run(s), {num_successes_total} of which succeeded.\n")
         report_file.write(f"That's a success rate of { (num_successes_total / (num_runs * args.threads)) *100:.2f}%.\n")
-        report_file.write(f"\nBest run time: {best_time:.2f} seconds\n")
-        report_file.write(f"Best run speed: {best_speed / 1024 / 1024 * 8:.2f} mbps\n")
-        report_file.write(f"Slowest run time: {slowest_time:.2f} seconds\n")
-        report_file.write(f"Slowest run speed: {slowest_speed / 1024 / 1024 * 8:.2f} mbps\n")
-        report_file.write(f"Average run time: {average_time:.2f} seconds\n")
-        report_file.write(f"Average run speed: {average_speed / 1024 / 1024 * 8:.2f} mbps\n")
+        report_file.write(f"\nBest run time: {best_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Best run speed: {best_speed / MIB * BITS_PER_BYTE:.2f} mbps\n")
+        report_file.write(f"Slowest run time: {slowest_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Slowest run speed: {slowest_speed / MIB * BITS_PER_BYTE:.2f} mbps\n")
+        report_file.write(f"Average run time: {average_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Average run speed: {average_speed / MIB * BITS_PER_BYTE:.2f} mbps\n")
         report_file.close()
 
 if __name__ == "__main__":
@@ -271,9 +652,19 @@ if __name__ == "__main__":
     parser.add_argument("-r", "--report", help="produce reports", action=argparse.BooleanOptionalAction)
     parser.add_argument("-s", "--silent", help="run silently - only produce reports", action=argparse.BooleanOptionalAction)
     parser.add_argument("-l", "--label", help="label to use for reports", default="MooseFS")
+    parser.add_argument("-a", "--asyncio", help="run all uploads from a single asyncio event loop instead of one thread each", action=argparse.BooleanOptionalAction)
+    parser.add_argument("-u", "--uring", help="submit all uploads as one io_uring batch (Linux only, needs liburing)", action=argparse.BooleanOptionalAction)
     args = parser.parse_args()
+    # Only one upload backend runs, so refuse combinations that would silently run a different one than asked for.
+    if args.uring and args.asyncio:
+        parser.error("--uring and --asyncio can't be used together")
+    if args.uring and platform.system() != "Linux":
+        parser.error("--uring is only available on Linux")
+    if args.uring and liburing is None:
+        parser.error("--uring needs the liburing package (pip install liburing)")
 
     report_timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+    total_data = args.threads * args.blobsize * MIB
 
     if args.report is not None:
         report_file = open(args.report, "w")
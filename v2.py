@@ -1,84 +1,253 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import datetime
+import http.client
+import mmap
 import os
+import queue
+import shlex
 import subprocess
 import time
 import sys
 import concurrent.futures
-from threading import Thread
 
-num_successes = 0
+MIB = 1024 * 1024
+BITS_PER_BYTE = 8
+# Timings are integer nanoseconds from perf_counter_ns(), only converted to seconds for output.
+NS_PER_SEC = 1000 * 1000 * 1000
 
-def generate_testfile(thread_num):
+num_successes = 0
+gateway_host = "localhost"
+gateway_port = 1313
+# Kept-alive connections to the gateway, shared between upload threads and reused across runs.
+upload_connections = queue.SimpleQueue()
+# Read-only mappings of every testfile, held open so their pages stay resident in the page cache.
+testfile_mmaps = []
+# One root shell, started through sudo at startup, runs every privileged command so we only pay for sudo once.
+privileged_shell = None
+
+def prepare_testfiles(executor):
     if not args.silent:
-        print(f"Generating testfile for thread {thread_num}")
-    subprocess.run(["dd", "if=/dev/urandom", f"of=testfile-{thread_num:03}.bin", f"bs={args.blobsize}M", "count=1"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        print(f"Generating testfiles for {args.threads} thread(s)")
+    # os.urandom lets go of the GIL, so the pool generates every testfile in parallel like one dd per thread did.
+    list(executor.map(write_random_testfile, (f"testfile-{i:03}.bin" for i in range(args.threads))))
+    # Fault every testfile into memory now, so uploads never wait on a cold disk read inside the timed section.
+    for thread_num in range(args.threads):
+        fd = os.open(f"testfile-{thread_num:03}.bin", os.O_RDONLY)
+        mm = mmap.mmap(fd, 0, flags=mmap.MAP_SHARED | mmap.MAP_POPULATE, prot=mmap.PROT_READ)
+        os.close(fd)
+        mm.madvise(mmap.MADV_WILLNEED)
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+        testfile_mmaps.append(mm)
+
+
+def write_random_testfile(testfile):
+    # Random from end to end, so no block the gateway chunks this upload into repeats in any other upload.
+    fd = os.open(testfile, os.O_WRONLY | os.O_CREAT, 0o644)
+    os.ftruncate(fd, args.blobsize * MIB)
+    for offset in range(0, args.blobsize * MIB, MIB):
+        os.pwrite(fd, os.urandom(MIB), offset)
+    # Flush it to disk now, so writeback doesn't compete with the uploads later.
+    os.fsync(fd)
+    os.close(fd)
+
+
+def multipart_form(testfile):
+    # Build the same multipart/form-data framing that `curl -F file=@testfile` would send around the file contents.
+    boundary = os.urandom(16).hex()
+    preamble = (f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(testfile)}\"\r\n"
+                "Content-Type: application/octet-stream\r\n\r\n").encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+    return boundary, preamble, epilogue
+
+
+def post_testfile(testfile):
+    boundary, preamble, epilogue = multipart_form(testfile)
+    content_length = len(preamble) + os.path.getsize(testfile) + len(epilogue)
+    # Reuse a kept-alive connection if one is spare, so we skip the TCP handshake on every upload.
+    try:
+        connection = upload_connections.get_nowait()
+    except queue.Empty:
+        connection = None
+    while True:
+        reused = connection is not None
+        if connection is None:
+            connection = http.client.HTTPConnection(gateway_host, gateway_port)
+        try:
+            connection.putrequest("POST", "/upload")
+            connection.putheader("Content-Type", f"multipart/form-data; boundary={boundary}")
+            connection.putheader("Content-Length", str(content_length))
+            connection.endheaders(message_body=preamble)
+            # Let the kernel move the file from the page cache straight onto the socket, no copy through Python.
+            with open(testfile, "rb") as f:
+                connection.sock.sendfile(f)
+            connection.send(epilogue)
+            response = connection.getresponse()
+            output = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if reused:
+                # The gateway may have been restarted since this connection was last used, so retry on a fresh one.
+                connection = None
+                continue
+            raise
+        upload_connections.put(connection)
+        return output
+
+
+def open_upload_connections():
+    # Have a connected keep-alive connection ready for every upload thread, so no handshake lands in the timed section.
+    for _ in range(args.threads):
+        connection = http.client.HTTPConnection(gateway_host, gateway_port)
+        try:
+            connection.connect()
+        except OSError:
+            # Leave it to the upload itself to connect and report the failure.
+            connection.close()
+            continue
+        upload_connections.put(connection)
+
+
+def close_upload_connections():
+    while not upload_connections.empty():
+        upload_connections.get_nowait().close()
 
 
 def upload_thread(thread_num, testfile):
-    global num_successes
-    start_time = time.monotonic()
-    result = subprocess.run(
-        ["curl", "-X", "POST", "-F", "file=@" + testfile, "localhost:1313/upload"],
-        capture_output=True, text=True)
-    end_time = time.monotonic()
+    start_time = time.perf_counter_ns()
+    try:
+        output = post_testfile(testfile).strip()
+    except (http.client.HTTPException, OSError) as e:
+        print(f"Error: Failed to send upload request for thread {thread_num}.")
+        print(e)
+        return None
+    end_time = time.perf_counter_ns()
+    transfer_time = end_time - start_time
+    if output.startswith(b"baf"):
+        # We successfully uploaded a file using this thread, record a victory!
+        # If we're not in silent mode, output a helpful message.
+        if not args.silent:
+            print(f"Thread {thread_num}: Upload succeeded, took {transfer_time / NS_PER_SEC:.2f} seconds end-to-end")
+        return transfer_time
+    else:
+        print(f"Error: Failed to upload file for thread {thread_num}.")
+        print(output.decode("utf-8", errors="replace"))
+    return None
+
+
+async def upload_coroutine(thread_num, testfile, stream):
+    if isinstance(stream, Exception):
+        print(f"Error: Failed to connect to the gateway for thread {thread_num}.")
+        print(stream)
+        return None
+    reader, writer = stream
+    boundary, preamble, epilogue = multipart_form(testfile)
+    content_length = len(preamble) + os.path.getsize(testfile) + len(epilogue)
+    request_headers = (f"POST /upload HTTP/1.1\r\n"
+                       f"Host: {gateway_host}:{gateway_port}\r\n"
+                       f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
+                       f"Content-Length: {content_length}\r\n"
+                       "Connection: close\r\n\r\n").encode()
+    start_time = time.perf_counter_ns()
+    try:
+        writer.write(request_headers + preamble)
+        with open(testfile, "rb") as f:
+            await asyncio.get_running_loop().sendfile(writer.transport, f)
+        writer.write(epilogue)
+        await writer.drain()
+        # The gateway closes the connection once it has answered, so everything up to EOF is the response.
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+    except OSError as e:
+        writer.close()
+        print(f"Error: Failed to send upload request for thread {thread_num}.")
+        print(e)
+        return None
+    end_time = time.perf_counter_ns()
     transfer_time = end_time - start_time
-    if result.returncode == 0:
-        output = result.stdout.strip()
-        if output.startswith("baf"):
-            # We successfully uploaded a file using this thread, record a victory!
-            num_successes += 1
-            # If we're not in silent mode, output a helpful message.
-            if not args.silent:
-                print(f"Thread {thread_num}: Upload succeeded, took {transfer_time:.2f} seconds end-to-end")
-            return transfer_time
-        else:
-            print(f"Error: Failed to upload file for thread {thread_num}.")
-            print(output)
+    output = response.partition(b"\r\n\r\n")[2].strip()
+    if output.startswith(b"baf"):
+        if not args.silent:
+            print(f"Thread {thread_num}: Upload succeeded, took {transfer_time / NS_PER_SEC:.2f} seconds end-to-end")
+        return transfer_time
     else:
-        print(f"Error: Failed to run curl command for thread {thread_num}.")
-        print(result)
+        print(f"Error: Failed to upload file for thread {thread_num}.")
+        print(output.decode("utf-8", errors="replace"))
     return None
 
 
-def run_upload():
+async def open_upload_streams():
+    # Connect every upload's stream up front, so like the other backends the clock only covers the uploads themselves.
+    return await asyncio.gather(*(asyncio.open_connection(gateway_host, gateway_port) for _ in range(args.threads)),
+                                return_exceptions=True)
+
+
+async def upload_all(streams):
+    # Every upload is in flight at once on this one event loop, no thread or process per upload.
+    return await asyncio.gather(*(upload_coroutine(i, f"testfile-{i:03}.bin", streams[i]) for i in range(args.threads)))
+
+
+def run_upload(executor):
     global num_successes
-    num_successes = 0
-    threads = []
-    slowest_time = float("-inf")
-    fastest_time = float("inf")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-        # Generate test files in parallel
-        executor.map(generate_testfile, range(args.threads))
-        # Wait for final disk activity to settle
-        time.sleep(1)
-        # Record the start time
-        start_time = time.monotonic()
-        # Upload files and record transfer times
+    if args.asyncio:
+        # Streams belong to the loop that opened them, so connect on the same loop that will run the uploads.
+        upload_loop = asyncio.new_event_loop()
+        upload_streams = upload_loop.run_until_complete(open_upload_streams())
+    else:
+        open_upload_connections()
+    # Record the start time
+    start_time = time.perf_counter_ns()
+    # Upload files and record transfer times
+    if args.asyncio:
+        transfer_times = upload_loop.run_until_complete(upload_all(upload_streams))
+        upload_loop.close()
+    else:
         futures = [executor.submit(upload_thread, i, f"testfile-{i:03}.bin") for i in range(args.threads)]
-        for future in concurrent.futures.as_completed(futures):
-            transfer_time = future.result()
-            if transfer_time is not None:
-                if transfer_time > slowest_time:
-                    slowest_time = transfer_time
-                if transfer_time < fastest_time:
-                    fastest_time = transfer_time
-
-    end_time = time.monotonic()
+        transfer_times = (future.result() for future in concurrent.futures.as_completed(futures))
+    successful_times = [transfer_time for transfer_time in transfer_times if transfer_time is not None]
+    # Count the victories here from the results, rather than having every upload bump a shared global.
+    num_successes = len(successful_times)
+    slowest_time = max(successful_times, default=float("-inf"))
+    fastest_time = min(successful_times, default=float("inf"))
+
+    end_time = time.perf_counter_ns()
     transfer_time = end_time - start_time
     return transfer_time, slowest_time, fastest_time, num_successes
 
 
+def start_privileged_shell():
+    global privileged_shell
+    privileged_shell = subprocess.Popen(["sudo", "sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    # Wait for sudo to authenticate now, rather than in the middle of the first gateway restart.
+    run_privileged(["true"])
+
+
+def run_privileged(command):
+    # The command's own output goes to stderr, so the only thing on our pipe is its exit status.
+    try:
+        privileged_shell.stdin.write(f"{shlex.join(command)} </dev/null >&2; echo $?\n")
+        privileged_shell.stdin.flush()
+        status = privileged_shell.stdout.readline()
+    except BrokenPipeError:
+        status = ""
+    if not status:
+        print(f"Error: The privileged shell exited with status {privileged_shell.wait()}, check that sudo works for this user.")
+        exit(1)
+    return int(status)
+
+
 def stop_gateway():
     if not args.silent:
         print("Stopping WhyPFS Gateway")
-    subprocess.run(["sudo", "systemctl", "stop", "whypfs-gateway"])
-    subprocess.run(["sudo", "systemctl", "stop", "whypfs-gateway-seaweed"])
-    time.sleep(1)
-    status = subprocess.run(["sudo", "systemctl", "is-active", "--quiet", "whypfs-gateway"])
-    if status.returncode == 0:
+    run_privileged(["systemctl", "stop", "whypfs-gateway", "whypfs-gateway-seaweed"])
+    # Kept-alive upload connections won't survive the restart, so don't hand them out again.
+    close_upload_connections()
+    # systemctl stop only returns once the unit is inactive, so this check needs no settling delay.
+    if run_privileged(["systemctl", "is-active", "--quiet", "whypfs-gateway"]) == 0:
         print("Error: Failed to stop whypfs-gateway.")
         exit(1)
 
@@ -87,101 +256,99 @@ def start_gateway():
     if not args.silent:
         print("Starting WhyPFS Gateway")
     if args.label == "MooseFS":
-        subprocess.run(["sudo", "systemctl", "start", "whypfs-gateway"])
+        run_privileged(["systemctl", "start", "whypfs-gateway"])
     else:
-        subprocess.run(["sudo", "systemctl", "start", "whypfs-gateway-seaweed"])
+        run_privileged(["systemctl", "start", "whypfs-gateway-seaweed"])
 
 
 def remove_folder():
     if not args.silent:
         print("Removing folder .whypfs")
     if args.label == "MooseFS":
-        subprocess.run(["sudo", "rm", "-r", "/mnt/mfs/.whypfs"])
+        run_privileged(["rm", "-r", "/mnt/mfs/.whypfs"])
     else:
-        subprocess.run(["sudo", "rm", "-r", "/mnt/seaweedfs/.whypfs"])
+        run_privileged(["rm", "-r", "/mnt/seaweedfs/.whypfs"])
     
 
 
 def wait_for_server():
     if not args.silent:
         print("Checking for IPFS Gateway liveness...")
+    # Probe over one connection, so once the gateway is listening each check skips the TCP handshake.
+    connection = http.client.HTTPConnection(gateway_host, gateway_port, timeout=0.5)
+    # Said once, the check itself repeats every 100 ms until the gateway answers.
+    if not args.silent:
+        print("Running check...")
     while True:
         try:
-            if not args.silent:
-                print("Running check...")
-            output = subprocess.check_output(
-                ["curl", "-s", "-f", "http://localhost:1313/gw/ipfs/QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"])
-            if output.decode("utf-8").strip() == "hello world":
+            if connection.sock is None:
+                connection.connect()
+                # The short timeout is only for connecting. With .whypfs freshly wiped the gateway may have to fetch
+                # the block from the network, so wait for its answer as long as it takes, like curl did.
+                connection.sock.settimeout(None)
+            connection.request("GET", "/gw/ipfs/QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o")
+            output = connection.getresponse().read()
+            if output.strip() == b"hello world":
                 if not args.silent:
                     print("\"Hello world\" found, which means IPFS is live. Continuing...")
                 break
-        except:
+        except (http.client.HTTPException, OSError):
             #print("Did not find the string we expected. Trying again...")
-            time.sleep(1)
-            pass
+            connection.close()
+        time.sleep(0.1)
+    connection.close()
 
 
 def print_report(run_number, transfer_time, slowest_time, fastest_time):
-    if args.threads == 1:
-        total_data = args.blobsize * 1024 * 1024
-    else:
-        total_data = args.threads * args.blobsize * 1024 * 1024
     if args.threads > 1:
         total_data_success = total_data * (num_successes / args.threads)
-    transfer_rate = total_data / transfer_time
+    transfer_rate = total_data * NS_PER_SEC / transfer_time
     # We're converting from bytes/s to mbps here.
-    mbps = transfer_rate / 1024 / 1024 * 8
+    mbps = transfer_rate / MIB * BITS_PER_BYTE
     # Now let's apply a modifier which is the bandwidth discounting failed threads, but only when we have more than 1 thread
     if args.threads > 1:
         mbps = mbps * (num_successes / args.threads)
-    print(f"\n=== Run {run_number} ===")
+    lines = [f"\n=== Run {run_number} ==="]
     if args.threads == 1:
-        print(f"Filename: testfile-000.bin")
+        lines.append(f"Filename: testfile-000.bin")
     else:
-        print("Filename: testfile-[threadid].bin")
-        print(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.")
-        print(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.")
-    print(f"Data transferred: {total_data / 1024 / 1024:.2f} MiB")
+        lines.append("Filename: testfile-[threadid].bin")
+        lines.append(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.")
+        lines.append(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.")
+    lines.append(f"Data transferred: {total_data / MIB:.2f} MiB")
     if args.threads > 1:
-        print(f"Data successfully transferred: {total_data_success / 1024 / 1024:.2f} MiB")
-        print(f"Slowest thread: {slowest_time:.2f} seconds")
-        print(f"Fastest thread: {fastest_time:.2f} seconds")
-    print(f"Transfer time: {transfer_time:.2f} seconds")
-    print(f"Transfer rate: {mbps:.2f} mbps")
+        lines.append(f"Data successfully transferred: {total_data_success / MIB:.2f} MiB")
+        lines.append(f"Slowest thread: {slowest_time / NS_PER_SEC:.2f} seconds")
+        lines.append(f"Fastest thread: {fastest_time / NS_PER_SEC:.2f} seconds")
+    lines.append(f"Transfer time: {transfer_time / NS_PER_SEC:.2f} seconds")
+    lines.append(f"Transfer rate: {mbps:.2f} mbps")
+    # One write per report instead of one per line.
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
-def save_report(run_number, transfer_time, slowest_time, fastest_time):
-    if args.threads == 1:
-        total_data = args.blobsize * 1024 * 1024
-    else:
-        total_data = args.threads * args.blobsize * 1024 * 1024
+def save_report(report_file, run_number, transfer_time, slowest_time, fastest_time):
     if args.threads > 1:
         total_data_success = total_data * (num_successes / args.threads)
-    transfer_rate = total_data / transfer_time
+    transfer_rate = total_data * NS_PER_SEC / transfer_time
     # We're converting from bytes/s to mbps here.
-    mbps = transfer_rate / 1024 / 1024 * 8
-    report_run_number = "{:03d}".format(run_number)
-    report_file_name = f"report-{report_timestamp}-{args.label}-{report_run_number}.txt"
-    report_file = open(report_file_name, 'w')
-
-    if report_file is not None:
-        report_file.write(f"\n=== Run {run_number} ===\n")
-        
-        if args.threads == 1:
-            report_file.write(f"Filename: testfile-000.bin")
-        else:
-            report_file.write("Filename: testfile-[threadid].bin")
-            report_file.write(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.")
-            report_file.write(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.")
-
-        report_file.write(f"Data transferred: {total_data / 1024 / 1024:.2f} MiB\n")
-        if args.threads > 1:
-            report_file.write(f"Data successfully transferred: {total_data_success / 1024 / 1024:.2f} MiB")
-            report_file.write(f"Slowest thread: {slowest_time:.2f} seconds")
-            report_file.write(f"Fastest thread: {fastest_time:.2f} seconds")
-        report_file.write(f"Transfer time: {transfer_time:.2f} seconds\n")
-        report_file.write(f"Transfer rate: {mbps:.2f} mbps\n")
-        report_file.close()
+    mbps = transfer_rate / MIB * BITS_PER_BYTE
+
+    report_file.write(f"\n=== Run {run_number} ===\n")
+
+    if args.threads == 1:
+        report_file.write(f"Filename: testfile-000.bin\n")
+    else:
+        report_file.write("Filename: testfile-[threadid].bin\n")
+        report_file.write(f"\nWe performed {args.threads} uploads across {args.threads} threads, {num_successes} of which succeeded.\n")
+        report_file.write(f"That's a success rate of { (num_successes / args.threads) * 100:.2f}%.\n")
+
+    report_file.write(f"Data transferred: {total_data / MIB:.2f} MiB\n")
+    if args.threads > 1:
+        report_file.write(f"Data successfully transferred: {total_data_success / MIB:.2f} MiB\n")
+        report_file.write(f"Slowest thread: {slowest_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Fastest thread: {fastest_time / NS_PER_SEC:.2f} seconds\n")
+    report_file.write(f"Transfer time: {transfer_time / NS_PER_SEC:.2f} seconds\n")
+    report_file.write(f"Transfer rate: {mbps:.2f} mbps\n")
 
 
 def run_continuous(num_runs):
@@ -193,55 +360,64 @@ def run_continuous(num_runs):
     slowest_speed = None
     total_time = 0
     total_speed = 0
-    for i in range(num_runs):
-        print(f"\nRunning test {i + 1}...")
-        stop_gateway()
-        remove_folder()
-        start_gateway()
-        wait_for_server()
-        transfer_time = run_upload()
-        # Grab the num_successes reported by our run of upload threads, and add it to the total number of successes.
-        num_successes_total += transfer_time[3]
-        print_report(i+1, transfer_time[0], transfer_time[1], transfer_time[2])
-        if args.report:
-            save_report(i+1, transfer_time[0], transfer_time[1], transfer_time[2])
-        total_data = args.threads * args.blobsize * 1024 * 1024
-        total_time += transfer_time[0]
-        total_speed += total_data / transfer_time[0]
-        if best_time is None:
-            best_time = transfer_time[0]
-            best_speed = total_data / transfer_time[0]
-        if transfer_time[0] < best_time:
-            best_time = transfer_time[0]
-            best_speed = total_data / transfer_time[0]
-        if slowest_time is None:
-            slowest_time = transfer_time[0]
-            slowest_speed = total_data / transfer_time[0]
-        if transfer_time[0] > slowest_time:
-            slowest_time = transfer_time[0]
-            slowest_speed = total_data / transfer_time[0]
+    # Share one pool of threads across every run instead of starting a fresh one each time, it generates the testfiles too.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.threads)
+    # The testfiles' contents are never inspected, so one set serves every run.
+    prepare_testfiles(executor)
+    # Every run's report goes into one buffered file, rather than opening and closing a file per run.
+    if args.report:
+        runs_report_file = open(f"report-{report_timestamp}-{args.label}-all.txt", "w", buffering=MIB)
+    with executor:
+        for i in range(num_runs):
+            print(f"\nRunning test {i + 1}...")
+            stop_gateway()
+            remove_folder()
+            start_gateway()
+            wait_for_server()
+            transfer_time = run_upload(executor)
+            # Grab the num_successes reported by our run of upload threads, and add it to the total number of successes.
+            num_successes_total += transfer_time[3]
+            print_report(i+1, transfer_time[0], transfer_time[1], transfer_time[2])
+            if args.report:
+                save_report(runs_report_file, i+1, transfer_time[0], transfer_time[1], transfer_time[2])
+            total_time += transfer_time[0]
+            total_speed += total_data * NS_PER_SEC / transfer_time[0]
+            if best_time is None:
+                best_time = transfer_time[0]
+                best_speed = total_data * NS_PER_SEC / transfer_time[0]
+            if transfer_time[0] < best_time:
+                best_time = transfer_time[0]
+                best_speed = total_data * NS_PER_SEC / transfer_time[0]
+            if slowest_time is None:
+                slowest_time = transfer_time[0]
+                slowest_speed = total_data * NS_PER_SEC / transfer_time[0]
+            if transfer_time[0] > slowest_time:
+                slowest_time = transfer_time[0]
+                slowest_speed = total_data * NS_PER_SEC / transfer_time[0]
+    if args.report:
+        runs_report_file.close()
     average_time = total_time / num_runs
     average_speed = total_speed / num_runs
 
     # We calculate how much data transfer occurred by considering how much failed as well.
-    overall_data_transferred = (num_successes_total / (num_runs * args.threads)) * (num_runs * args.threads) * args.blobsize * 1024 * 1024
-    overall_data_transferred_MiB = overall_data_transferred / (1024 * 1024)
+    overall_data_transferred = (num_successes_total / (num_runs * args.threads)) * (num_runs * args.threads) * args.blobsize * MIB
+    overall_data_transferred_MiB = overall_data_transferred / MIB
 
-    transfer_rate = overall_data_transferred / total_time
-    mbps = transfer_rate / 1024 / 1024 * 8
+    transfer_rate = overall_data_transferred * NS_PER_SEC / total_time
+    mbps = transfer_rate / MIB * BITS_PER_BYTE
 
     # Print final report
     print(f"\n=== Final Report ===")
-    print(f"We moved {overall_data_transferred_MiB}MiB in {round(total_time, 3):.2f} seconds")
+    print(f"We moved {overall_data_transferred_MiB}MiB in {total_time / NS_PER_SEC:.2f} seconds")
     print(f"That's a transfer rate of {mbps:.2f} mbps.")
     print(f"\nWe performed {num_runs * args.threads} transfers across {num_runs} total run(s), {num_successes_total} of which succeeded.")
     print(f"That's a success rate of { (num_successes_total / (num_runs * args.threads)) *100:.2f}%.")
-    print(f"\nBest run time: {best_time:.2f} seconds")
-    print(f"Best run speed: {best_speed / 1024 / 1024 * 8:.2f} mbps")
-    print(f"Slowest run time: {slowest_time:.2f} seconds")
-    print(f"Slowest run speed: {slowest_speed / 1024 / 1024 * 8:.2f} mbps")
-    print(f"Average run time: {average_time:.2f} seconds")
-    print(f"Average run speed: {average_speed / 1024 / 1024 * 8:.2f} mbps")
+    print(f"\nBest run time: {best_time / NS_PER_SEC:.2f} seconds")
+    print(f"Best run speed: {best_speed / MIB * BITS_PER_BYTE:.2f} mbps")
+    print(f"Slowest run time: {slowest_time / NS_PER_SEC:.2f} seconds")
+    print(f"Slowest run speed: {slowest_speed / MIB * BITS_PER_BYTE:.2f} mbps")
+    print(f"Average run time: {average_time / NS_PER_SEC:.2f} seconds")
+    print(f"Average run speed: {average_speed / MIB * BITS_PER_BYTE:.2f} mbps")
 
     # Save final report
     if args.report:
@@ -249,16 +425,16 @@ def run_continuous(num_runs):
         report_file_name = f"report-{report_timestamp}-{args.label}-final.txt"
         report_file = open(report_file_name, 'w')
         report_file.write(f"\n=== Final Report ===\n")
-        report_file.write(f"We moved {overall_data_transferred_MiB}MiB in {round(total_time, 3):.2f} seconds\n")
+        report_file.write(f"We moved {overall_data_transferred_MiB}MiB in {total_time / NS_PER_SEC:.2f} seconds\n")
         report_file.write(f"That's a transfer rate of {mbps:.2f} mbps.\n")
         report_file.write(f"\nWe performed {num_runs * args.threads} transfers across {num_runs} total run(s), {num_successes_total} of which succeeded.\n")
         report_file.write(f"That's a success rate of { (num_successes_total / (num_runs * args.threads)) *100:.2f}%.\n")
-        report_file.write(f"\nBest run time: {best_time:.2f} seconds\n")
-        report_file.write(f"Best run speed: {best_speed / 1024 / 1024 * 8:.2f} mbps\n")
-        report_file.write(f"Slowest run time: {slowest_time:.2f} seconds\n")
-        report_file.write(f"Slowest run speed: {slowest_speed / 1024 / 1024 * 8:.2f} mbps\n")
-        report_file.write(f"Average run time: {average_time:.2f} seconds\n")
-        report_file.write(f"Average run speed: {average_speed / 1024 / 1024 * 8:.2f} mbps\n")
+        report_file.write(f"\nBest run time: {best_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Best run speed: {best_speed / MIB * BITS_PER_BYTE:.2f} mbps\n")
+        report_file.write(f"Slowest run time: {slowest_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Slowest run speed: {slowest_speed / MIB * BITS_PER_BYTE:.2f} mbps\n")
+        report_file.write(f"Average run time: {average_time / NS_PER_SEC:.2f} seconds\n")
+        report_file.write(f"Average run speed: {average_speed / MIB * BITS_PER_BYTE:.2f} mbps\n")
         report_file.close()
 
 if __name__ == "__main__":
@@ -269,9 +445,12 @@ if __name__ == "__main__":
     parser.add_argument("-r", "--report", help="produce reports", action=argparse.BooleanOptionalAction)
     parser.add_argument("-s", "--silent", help="run silently - only produce reports", action=argparse.BooleanOptionalAction)
     parser.add_argument("-l", "--label", help="label to use for reports", default="MooseFS")
+    parser.add_argument("-a", "--asyncio", help="run all uploads from a single asyncio event loop instead of one thread each", action=argparse.BooleanOptionalAction)
     args = parser.parse_args()
 
     report_timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+    start_privileged_shell()
+    total_data = args.threads * args.blobsize * MIB
 
     if args.report is not None:
         report_file = open(args.report, "w")
@@ -282,10 +461,13 @@ if __name__ == "__main__":
         remove_folder()
         start_gateway()
         wait_for_server()
-        transfer_time = run_upload()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+            prepare_testfiles(executor)
+            transfer_time = run_upload(executor)
         print_report(1, transfer_time[0], transfer_time[1], transfer_time[2])
         if args.report:
-            save_report(1, transfer_time[0], transfer_time[1], transfer_time[2])
+            with open(f"report-{report_timestamp}-{args.label}-all.txt", "w") as runs_report_file:
+                save_report(runs_report_file, 1, transfer_time[0], transfer_time[1], transfer_time[2])
     else:
         run_continuous(args.continuous)
 